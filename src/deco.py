@@ -1,8 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import pickle
-from functools import update_wrapper, wraps
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import partial, update_wrapper, wraps
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+HISTOGRAM_BUCKETS = 32  # the last one is for calls longer than ~18 minutes
+DISK_TIMEOUT = 30  # seconds to wait for a lock of the memo database
+DISK_MAXSIZE = 100000  # entries of a function in the memo database
+DISK_BATCH = 100  # access times to write at once, sets between evictions
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# name of a function -> CallStat, filled by instrument; stats live as long
+# as their functions
+REGISTRY = weakref.WeakValueDictionary()
+REGISTERED = {}  # name -> number of functions registered under it
+REGISTRY_LOCK = threading.Lock()
+INSTRUMENTATION = {'enabled': True}
+timer = getattr(time, 'perf_counter', time.time)
 
 
 def disable(func):
@@ -28,38 +65,768 @@ def decorator(decorator_as_func):
     return update_wrapper(wrapper, decorator_as_func)
 
 
+class CallStat(object):
+    """
+    Statistic of calls of a function: number of calls, cumulative and max
+    wall time and a histogram of durations. Bucket i of the histogram counts
+    calls that took less than 2 ** i microseconds (and not less than
+    2 ** (i - 1)), the last bucket counts all the longer ones.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.lock = threading.Lock()
+
+    def record(self, duration):
+        bucket = min(int(duration * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        with self.lock:
+            self.calls += 1
+            self.total += duration
+            if duration > self.max:
+                self.max = duration
+            self.histogram[bucket] += 1
+
+    def reset(self):
+        with self.lock:
+            self.calls = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'calls': self.calls,
+                'total': self.total,
+                'avg': self.total / self.calls if self.calls else 0.0,
+                'max': self.max,
+                'histogram': list(self.histogram),
+            }
+
+
+def register(name):
+    """
+    Every instrumented function gets its own statistic, even if another
+    one has the same name (closures, lambdas, methods of different classes)
+    :param name: name of a function
+    :return: new CallStat in REGISTRY under name or under name#2, name#3,
+    etc. if there was already a function with this name
+    """
+    with REGISTRY_LOCK:
+        number = REGISTERED.get(name, 0) + 1
+        REGISTERED[name] = number
+        key = name if number == 1 else '{}#{}'.format(name, number)
+        stat = REGISTRY[key] = CallStat(key)
+    return stat
+
+
+def set_instrumentation(enabled):
+    """
+    Turn instrumentation on or off at runtime. When it's off an instrumented
+    function costs one more call and a check of a flag.
+    """
+    INSTRUMENTATION['enabled'] = enabled
+
+
+def instrument(func=None, name=None):
+    """
+    Record calls of the function decorated in REGISTRY: number of calls,
+    cumulative and max wall time and a histogram of durations.
+
+    @instrument
+    def parse_log(log_path):
+        ....
+
+    @instrument(name='parser')
+    def parse_log(log_path):
+        ....
+
+    The number of calls is also kept in parse_log.calls and the statistic
+    in parse_log.stat. Every decorated function has its own statistic: if
+    the name is taken by another one, it's registered as name#2, etc.
+    Use stats_report() or stats_snapshot() to see the statistic.
+    """
+    if func is None:
+        return partial(instrument, name=name)
+
+    stat = register(name or '{}.{}'.format(func.__module__, func.__name__))
+    state = INSTRUMENTATION
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not state['enabled']:
+            return func(*args, **kwargs)
+        start = timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stat.record(timer() - start)
+            wrapper.calls = stat.calls
+
+    wrapper.calls = stat.calls
+    wrapper.stat = stat
+    return wrapper
+
+
 def countcalls(func):
-    """Decorator that counts calls made to the function decorated."""
+    """
+    Decorator that counts calls made to the function decorated.
+    Kept for compatibility: it's instrument, the number of calls is in
+    func.calls.
+    """
+    return instrument(func)
+
+
+def stats_snapshot():
+    """
+    :return: list of dicts with statistic of instrumented functions sorted
+    by cumulative time
+    """
+    stats = [stat.as_dict() for stat in REGISTRY.values()]
+    stats.sort(key=lambda d: d['total'], reverse=True)
+    return stats
+
+
+def stats_json():
+    """
+    :return: str with JSON snapshot of statistic of instrumented functions
+    """
+    return json.dumps({'time': time.time(), 'stats': stats_snapshot()})
+
+
+def stats_report(sort='total', limit=None):
+    """
+    :param sort: column to sort by: calls, total, avg or max
+    :param limit: max number of functions to report
+    :return: str with a table of instrumented functions that were called
+    """
+    stats = [d for d in stats_snapshot() if d['calls']]
+    stats.sort(key=lambda d: d[sort], reverse=True)
+    lines = ['{:>10} {:>12} {:>12} {:>12}  {}'.format(
+        'calls', 'total, s', 'avg, ms', 'max, ms', 'function')]
+    for d in stats[:limit]:
+        lines.append('{:>10} {:>12.6f} {:>12.6f} {:>12.6f}  {}'.format(
+            d['calls'], d['total'], d['avg'] * 1e3, d['max'] * 1e3,
+            d['name']))
+    return '\n'.join(lines)
+
+
+def reset_stats():
+    for stat in REGISTRY.values():
+        stat.reset()
+
+
+class _Pickled(object):
+    """Key of unhashable arguments: the arguments pickled"""
+    __slots__ = ('data',)
+
+    def __init__(self, args):
+        self.data = pickle.dumps(args, pickle.HIGHEST_PROTOCOL)
+
+    def __hash__(self):
+        return hash(self.data)
+
+    def __eq__(self, other):
+        return isinstance(other, _Pickled) and self.data == other.data
+
+
+class _MemoryStore(object):
+    """
+    Cache for memo: least recently used entries are evicted when there are
+    more than maxsize of them, entries older than ttl seconds are expired.
+    All operations are O(1) amortized: with maxsize entries are links of a
+    circular doubly linked list [prev, next, key, value, expires] ordered by
+    use, with ttl only expired entries are swept on set() from a queue of
+    (expires, key) ordered by expiration.
+    """
+    blocking = False
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = {}
+        self.expiring = deque()
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None]
+
+    @staticmethod
+    def make_key(args):
+        """
+        :param args: arguments of a call
+        :return: arguments with their types, so 1, 1.0 and True are
+        different keys (the key is unhashable if an argument is)
+        """
+        return args + tuple([type(x) for x in args])
+
+    def get(self, key):
+        """
+        :param key: hashable key
+        :return: cached value, raise KeyError if there is no such value
+        """
+        if self.maxsize is None:
+            if self.ttl is None:
+                return self.data[key]
+            value, expires = self.data[key]
+            if expires < time.time():
+                del self.data[key]
+                raise KeyError(key)
+            return value
+
+        link = self.data[key]
+        prev, following, _, value, expires = link
+        if expires is not None and expires < time.time():
+            prev[1] = following
+            following[0] = prev
+            del self.data[key]
+            raise KeyError(key)
+        # the most recently used link goes right before root
+        prev[1] = following
+        following[0] = prev
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        if self.maxsize is None:
+            if self.ttl is None:
+                self.data[key] = value
+                return
+            self.data[key] = (value, expires)
+            self.expiring.append((expires, key))
+            self.sweep()
+            return
+
+        if key in self.data:
+            prev, following = self.data.pop(key)[:2]
+            prev[1] = following
+            following[0] = prev
+        root = self.root
+        last = root[0]
+        link = [last, root, key, value, expires]
+        last[1] = root[0] = self.data[key] = link
+        if len(self.data) > self.maxsize:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self.data[oldest[2]]
+
+    def sweep(self):
+        """Remove expired entries (with ttl and without maxsize)"""
+        expiring = self.expiring
+        data = self.data
+        now = time.time()
+        while expiring and expiring[0][0] < now:
+            expires, key = expiring.popleft()
+            # the key could be set again or deleted since then
+            entry = data.get(key)
+            if entry is not None and entry[1] == expires:
+                del data[key]
+
+    def delete(self, key):
+        if self.maxsize is None:
+            self.data.pop(key, None)
+            return
+        link = self.data.pop(key, None)
+        if link is not None:
+            prev, following = link[:2]
+            prev[1] = following
+            following[0] = prev
+
+    def clear(self):
+        self.data.clear()
+        self.expiring.clear()
+        self.root[:] = [self.root, self.root, None, None, None]
+
+    def __len__(self):
+        if self.maxsize is None and self.ttl is not None:
+            self.sweep()
+        return len(self.data)
+
+
+class _DiskStore(object):
+    """
+    Cache for memo in a local sqlite database, shared by all processes on
+    the host. Entries of a function are keyed by a hash of its module, name,
+    first line and pickled arguments. There are at most maxsize (DISK_MAXSIZE by
+    default) of them: every DISK_BATCH sets (of a process) expired entries
+    are deleted and the least recently used ones are evicted, so the cap can
+    be exceeded by DISK_BATCH entries per process for a while. Access times
+    are kept in memory and written in batches, so a hit is only a read.
+    Every thread (and every forked process) gets its own connection,
+    sqlite's locks take care of concurrent readers and writers.
+    """
+    blocking = True  # does I/O, memo doesn't call it under its lock
+
+    def __init__(self, db_path, func, maxsize=None, ttl=None):
+        if (func.__name__ == '<lambda>' or
+                getattr(func, '__closure__', None)):
+            raise ValueError(
+                'memo with persist needs a named function without a '
+                'closure, {!r} is not'.format(func))
+        self.db_path = db_path
+        code = getattr(func, '__code__', None)
+        # the line tells apart functions with the same name in a module
+        self.func_id = '{}.{}:{}'.format(
+            func.__module__, func.__name__,
+            code.co_firstlineno if code is not None else 0)
+        self.maxsize = DISK_MAXSIZE if maxsize is None else maxsize
+        self.ttl = ttl
+        self.local = threading.local()
+        self.lock = threading.Lock()  # guards accessed and sets
+        self.accessed = {}  # hashed key -> time of the last hit
+        self.sets = 0
+        self.evict_every = max(1, min(DISK_BATCH, self.maxsize // 10))
+
+    def conn(self):
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.db_path, timeout=DISK_TIMEOUT,
+                                   isolation_level=None)
+            # readers don't block the writer and vice versa; losing the
+            # last writes on a power failure is fine for a cache
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, '
+                'func TEXT NOT NULL, value BLOB NOT NULL, expires REAL, '
+                'accessed REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS memo_func_accessed '
+                         'ON memo (func, accessed)')
+            conn.execute('CREATE INDEX IF NOT EXISTS memo_func_expires '
+                         'ON memo (func, expires)')
+            self.local.pid = pid
+            self.local.conn = conn
+        return self.local.conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def make_key(args):
+        """
+        :param args: arguments of a call
+        :return: _Pickled arguments, pickle keeps their types
+        """
+        return _Pickled(args)
+
+    def hash_key(self, key):
+        """
+        :param key: _Pickled arguments
+        :return: str with hash stable between processes
+        """
+        return hashlib.sha1(self.func_id.encode('utf-8') + b'\0' +
+                            key.data).hexdigest()
+
+    def get(self, key):
+        """
+        :param key: _Pickled arguments
+        :return: cached value, raise KeyError if there is no such value
+        """
+        key = self.hash_key(key)
+        now = time.time()
+        row = self.conn().execute(
+            'SELECT value FROM memo WHERE key = ? AND '
+            '(expires IS NULL OR expires >= ?)', (key, now)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        with self.lock:
+            self.accessed[key] = now
+            flush = len(self.accessed) >= DISK_BATCH
+        if flush:
+            with self.transaction() as conn:
+                self.write_accessed(conn)
+        return pickle.loads(bytes(row[0]))
+
+    def write_accessed(self, conn):
+        """Write access times of the hits since the last write"""
+        with self.lock:
+            accessed, self.accessed = self.accessed, {}
+        if accessed:
+            conn.executemany(
+                'UPDATE memo SET accessed = ? WHERE key = ?',
+                [(when, key) for key, when in accessed.iteritems()]
+            )
+
+    def set(self, key, value):
+        key = self.hash_key(key)
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        value = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.sets += 1
+            evict = self.sets % self.evict_every == 0
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO memo '
+                '(key, func, value, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, self.func_id, value, expires, now)
+            )
+            if evict:
+                self.evict(conn, now)
+
+    def evict(self, conn, now):
+        """Delete expired entries and the least recently used over maxsize"""
+        self.write_accessed(conn)
+        conn.execute('DELETE FROM memo WHERE func = ? AND expires < ?',
+                     (self.func_id, now))
+        conn.execute(
+            'DELETE FROM memo WHERE key IN (SELECT key FROM memo '
+            'WHERE func = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (self.func_id, self.maxsize)
+        )
+
+    def delete(self, key):
+        self.conn().execute('DELETE FROM memo WHERE key = ?',
+                            (self.hash_key(key),))
+
+    def clear(self):
+        with self.lock:
+            self.accessed.clear()
+        self.conn().execute('DELETE FROM memo WHERE func = ?',
+                            (self.func_id,))
+
+    def __len__(self):
+        return self.conn().execute(
+            'SELECT COUNT(*) FROM memo WHERE func = ? AND '
+            '(expires IS NULL OR expires >= ?)', (self.func_id, time.time())
+        ).fetchone()[0]
+
+
+def _refresh(wrapper, func, own):
+    """
+    Copy attributes of func that could be changed by a call (e.g. calls of
+    countcalls) to wrapper. It's much cheaper than update_wrapper.
+    :param own: names of wrapper's own attributes, they are never copied
+    """
+    for name, value in func.__dict__.items():
+        if name not in own:
+            wrapper.__dict__[name] = value
+
+
+class _Call(object):
+    """Call in progress: the other callers with the same key wait for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def wait(self):
+        self.done.wait()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+def _single_flight(func, store, stat, own, lock):
+    """
+    Thread-safe memo wrapper: only the first caller computes a value for a
+    key, the others wait for its result (or its exception). The lock guards
+    only O(1) operations with the in-memory store and the calls in progress,
+    a function and I/O of the disk store are always called without it, so
+    callers with different keys never wait for each other.
+    """
+    in_flight = {}
+    make_key = store.make_key
+    blocking = store.blocking
 
     @wraps(func)
     def wrapper(*args):
-        res = func(*args)
-        wrapper.calls += 1
-        update_wrapper(wrapper, func)
+        key = make_key(args)
+        try:
+            hash(key)
+        except TypeError:
+            key = _Pickled(args)
+
+        with lock:
+            if not blocking:
+                try:
+                    res = store.get(key)
+                except KeyError:
+                    pass
+                else:
+                    stat['hits'] += 1
+                    return res
+            call = in_flight.get(key)
+            if call is None:
+                call = in_flight[key] = _Call()
+                leader = True
+            else:
+                stat['hits'] += 1
+                leader = False
+
+        if not leader:
+            return call.wait()
+        cached = False
+        try:
+            if blocking:
+                try:
+                    res = store.get(key)
+                    cached = True
+                except KeyError:
+                    pass
+            if not cached:
+                res = func(*args)
+                if blocking:
+                    store.set(key, res)
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            with lock:
+                stat['misses'] += 1
+                del in_flight[key]
+            call.done.set()
+            raise
+        with lock:
+            if not blocking:
+                store.set(key, res)
+            stat['hits' if cached else 'misses'] += 1
+            del in_flight[key]
+        call.result = res
+        call.done.set()
+        if not cached and func.__dict__:
+            _refresh(wrapper, func, own)
         return res
 
-    wrapper.calls = 0
     return wrapper
 
 
-def memo(func):
+def memo(func=None, maxsize=None, ttl=None, threadsafe=False, persist=None):
     """
     Memoize a function so that it caches all return values for
     faster future lookups.
+
+    @memo
+    def fib(n):
+        ....
+
+    @memo(maxsize=1000, ttl=60, threadsafe=True)
+    def get_user(user_id):
+        ....
+
+    @memo(maxsize=100000, persist='/var/tmp/memo.db')
+    def get_stat(log_path):
+        ....
+
+    Hashable arguments are used as a key with their types (1, 1.0 and True
+    are different keys), only unhashable ones are pickled. With maxsize the
+    least recently used values are evicted, with ttl values expire in ttl
+    seconds. With threadsafe the cache can be shared by threads and
+    concurrent calls with the same arguments are computed only once. With
+    persist values are kept in a sqlite database at that path, so they are
+    shared by processes and survive restarts (arguments and values have to
+    be picklable), maxsize is DISK_MAXSIZE by default there. The values are
+    keyed by the module, the name and the first line of the function, so
+    lambdas and closures (different functions under one name) are refused.
+    Statistic is available with fib.cache_info() and the cache is dropped
+    with fib.cache_clear().
+    """
+    if func is None:
+        return partial(memo, maxsize=maxsize, ttl=ttl, threadsafe=threadsafe,
+                       persist=persist)
+
+    if persist is not None:
+        store = _DiskStore(persist, func, maxsize, ttl)
+    else:
+        store = _MemoryStore(maxsize, ttl)
+    stat = {'hits': 0, 'misses': 0}
+    own = ('cache_info', 'cache_clear')
+    lock = threading.Lock() if threadsafe else None
+
+    make_key = store.make_key
+
+    if threadsafe:
+        wrapper = _single_flight(func, store, stat, own, lock)
+    else:
+        @wraps(func)
+        def wrapper(*args):
+            try:
+                key = make_key(args)
+                try:
+                    res = store.get(key)
+                except TypeError:
+                    key = _Pickled(args)
+                    res = store.get(key)
+            except KeyError:
+                stat['misses'] += 1
+                res = func(*args)
+                store.set(key, res)
+                if func.__dict__:
+                    _refresh(wrapper, func, own)
+                return res
+            stat['hits'] += 1
+            return res
+
+    def cache_info():
+        return CacheInfo(stat['hits'], stat['misses'], store.maxsize,
+                         len(store))
+
+    def cache_clear():
+        if lock is not None:
+            if store.blocking:
+                store.clear()
+            with lock:
+                if not store.blocking:
+                    store.clear()
+                stat['hits'] = stat['misses'] = 0
+        else:
+            store.clear()
+            stat['hits'] = stat['misses'] = 0
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+def _as_future(func, res):
+    """
+    :param res: result of a call of a coroutine function
+    :return: future with add_done_callback (asyncio, concurrent.futures,
+    tornado, etc.), a coroutine is scheduled as a task
+    """
+    if asyncio is not None and asyncio.iscoroutine(res):
+        return asyncio.ensure_future(res)
+    if not hasattr(res, 'add_done_callback'):
+        raise TypeError(
+            '{}() returned {!r}, not a future or a coroutine'.format(
+                func.__name__, res)
+        )
+    return res
+
+
+def _failed(future):
+    """
+    :param future: done future
+    :return: True if future is cancelled or raised an exception
+    """
+    cancelled = getattr(future, 'cancelled', None)
+    if cancelled is not None and cancelled():
+        return True
+    return future.exception() is not None
+
+
+def async_memo(func=None, maxsize=None, ttl=None):
+    """
+    memo for functions that return a future or a coroutine (asyncio,
+    concurrent.futures, tornado, etc.): the future is cached, so the value
+    is awaited only once and every later call returns the same done
+    future. Concurrent calls with the same arguments get the same future
+    that is in progress. Failed and cancelled futures are dropped from the
+    cache. The cache is guarded by a lock, as done callbacks of
+    concurrent.futures run in worker threads. A future is bound to its
+    event loop, so the cache should not be shared by several loops.
+
+    @async_memo(maxsize=1000, ttl=60)
+    @asyncio.coroutine
+    def get_user(user_id):
+        ....
     """
-    memo_store = {}
+    if func is None:
+        return partial(async_memo, maxsize=maxsize, ttl=ttl)
+
+    store = _MemoryStore(maxsize, ttl)
+    stat = {'hits': 0, 'misses': 0}
+    lock = threading.Lock()
 
     @wraps(func)
     def wrapper(*args):
-        pickled = pickle.dumps(args)
-        if pickled in memo_store:
-            return memo_store[pickled]
-        else:
-            res = func(*args)
-            update_wrapper(wrapper, func)
-            memo_store[pickled] = res
-            return res
+        key = store.make_key(args)
+        try:
+            hash(key)
+        except TypeError:
+            key = _Pickled(args)
+        with lock:
+            try:
+                future = store.get(key)
+            except KeyError:
+                stat['misses'] += 1
+            else:
+                stat['hits'] += 1
+                return future
+
+        future = _as_future(func, func(*args))
+        with lock:
+            store.set(key, future)
 
+        def drop_failed(done):
+            if not _failed(done):
+                return
+            with lock:
+                try:
+                    if store.get(key) is done:
+                        store.delete(key)
+                except KeyError:
+                    pass
+
+        future.add_done_callback(drop_failed)
+        return future
+
+    def cache_info():
+        with lock:
+            return CacheInfo(stat['hits'], stat['misses'], maxsize,
+                             len(store))
+
+    def cache_clear():
+        with lock:
+            store.clear()
+            stat['hits'] = stat['misses'] = 0
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+def async_instrument(func=None, name=None):
+    """
+    instrument for functions that return a future or a coroutine: the time
+    is measured from the call till the future is done, i.e. the time it's
+    awaited, not the time to create a coroutine.
+
+    @async_instrument
+    @asyncio.coroutine
+    def fetch(url):
+        ....
+    """
+    if func is None:
+        return partial(async_instrument, name=name)
+
+    stat = register(name or '{}.{}'.format(func.__module__, func.__name__))
+    state = INSTRUMENTATION
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not state['enabled']:
+            return func(*args, **kwargs)
+        start = timer()
+        future = _as_future(func, func(*args, **kwargs))
+
+        def record(done):
+            stat.record(timer() - start)
+            wrapper.calls = stat.calls
+
+        future.add_done_callback(record)
+        return future
+
+    wrapper.calls = stat.calls
+    wrapper.stat = stat
     return wrapper
 
 
@@ -67,33 +834,163 @@ def memo(func):
 # memo = disable
 
 
-def n_ary(func):
+def _fold(func, args):
+    """
+    Right fold of args with binary func: f(x, f(y, z)), without recursion
+    """
+    res = args[-1]
+    for i in xrange(len(args) - 2, -1, -1):
+        res = func(args[i], res)
+    return res
+
+
+def _fold_chunks(func, args, pool, chunksize):
+    """
+    Fold chunks of args in pool, then fold their results the same way.
+    The order of args is kept, so func has to be only associative.
+    """
+    while len(args) > chunksize:
+        chunks = [args[i:i + chunksize]
+                  for i in xrange(0, len(args), chunksize)]
+        args = pool.map(partial(_fold, func), chunks)
+    return _fold(func, args)
+
+
+def n_ary(func=None, associative=False, pool=None, chunksize=10000):
     """
     Given binary function f(x, y), return an n_ary function such
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x.
 
+    If f is associative, long lists of arguments can be reduced in chunks
+    of chunksize (at least 2) in pool (multiprocessing.Pool or ThreadPool),
+    e.g.
+    add = n_ary(operator.add, associative=True, pool=ThreadPool(4))
+
+    With a process pool f is pickled by reference, so it has to be found
+    by its name in the workers: a builtin or a module-level function under
+    its own name that existed when the pool was started. The decorator form
+    @n_ary(associative=True, pool=Pool()) doesn't work with a process pool:
+    the name refers to the wrapper, not to f, and pickling fails. Keep f
+    undecorated and wrap it under another name instead:
+    add = n_ary(_add, associative=True, pool=pool)
     """
+    if func is None:
+        return partial(n_ary, associative=associative, pool=pool,
+                       chunksize=chunksize)
+    if chunksize < 2:
+        raise ValueError('chunksize should be at least 2, not {}'.format(
+            chunksize))
 
-    def split_args(source_func, *args):
-        if len(args) == 1:
-            return args[0]
-        elif len(args) == 2:
-            return source_func(*args)
-        else:
-            return split_args(
-                source_func, args[0], split_args(source_func, *args[1:])
+    parallel = associative and pool is not None
+
+    @wraps(func)
+    def wrapper(*args):
+        if not args:
+            raise TypeError(
+                '{}() takes at least 1 argument (0 given)'.format(
+                    func.__name__)
             )
+        if parallel and len(args) > chunksize:
+            return _fold_chunks(func, args, pool, chunksize)
+        return _fold(func, args)
+
+    return wrapper
+
+
+class _Raised(object):
+    """Result of a traced call that raised an exception"""
+    __slots__ = ('exc',)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+    def __str__(self):
+        return 'raised {!r}'.format(self.exc)
+
+
+def _ring_trace(func, filler, size, sample):
+    """
+    Trace calls into a ring buffer of the last size events per thread.
+    An event is a tuple (number, depth, args, result, duration): args and
+    result are kept as references and formatted only by dump_trace().
+    Only every sample-th call of a thread is recorded. Buffers of finished
+    threads are dropped when another thread makes its first call or after
+    they are dumped.
+    """
+    local = threading.local()
+    buffers = []  # (thread weakref, name, events) of threads that made calls
+    lock = threading.Lock()
+
+    def alive(buf):
+        thread = buf[0]()
+        return thread is not None and thread.is_alive()
+
+    def events():
+        local.depth = 0
+        local.number = 0
+        local.events = deque(maxlen=size)
+        thread = threading.current_thread()
+        with lock:
+            buffers[:] = [buf for buf in buffers if alive(buf)]
+            buffers.append((weakref.ref(thread), thread.name, local.events))
+        return local.events
 
     @wraps(func)
     def wrapper(*args):
-        res = split_args(func, *args)
-        update_wrapper(wrapper, func)
+        try:
+            depth = local.depth
+        except AttributeError:
+            events()
+            depth = 0
+        number = local.number
+        local.number = number + 1
+        if number % sample:
+            local.depth = depth + 1
+            try:
+                return func(*args)
+            finally:
+                local.depth = depth
+
+        local.depth = depth + 1
+        start = timer()
+        try:
+            res = func(*args)
+        except BaseException as e:
+            local.events.append(
+                (number, depth, args, _Raised(e), timer() - start))
+            raise
+        finally:
+            local.depth = depth
+        local.events.append((number, depth, args, res, timer() - start))
         return res
 
+    def dump_trace():
+        """
+        :return: str with the recorded calls of every thread in order
+        """
+        lines = []
+        with lock:
+            threads = [(name, list(recorded)) for _, name, recorded in buffers]
+            buffers[:] = [buf for buf in buffers if alive(buf)]
+        for name, recorded in threads:
+            lines.append('Thread {}:'.format(name))
+            for _, depth, args, res, duration in sorted(recorded):
+                lines.append('{} {}({}) == {} in {:.1f} us'.format(
+                    filler * depth, func.__name__,
+                    ','.join(str(x) for x in args), res, duration * 1e6))
+        return '\n'.join(lines)
+
+    def clear_trace():
+        with lock:
+            for _, _, recorded in buffers:
+                recorded.clear()
+
+    wrapper.dump_trace = dump_trace
+    wrapper.clear_trace = clear_trace
     return wrapper
 
 
-def trace(filler):
+def trace(filler, size=None, sample=1):
     """Trace calls made to function decorated.
 
     @trace("____")
@@ -112,9 +1009,37 @@ def trace(filler):
     ____ <-- fib(1) == 1
      <-- fib(3) == 3
 
+    With size calls are not printed but recorded into a ring buffer of the
+    last size calls per thread (with sample - every sample-th call only).
+    It's cheap enough to leave it on, the calls are formatted on demand:
+
+    @trace("____", size=10000)
+    def fib(n):
+        ....
+
+    >>> fib(3)
+    >>> print fib.dump_trace()
+    Thread MainThread:
+     fib(3) == 3 in 12.2 us
+    ____ fib(2) == 2 in 7.1 us
+    ________ fib(1) == 1 in 0.9 us
+    ...
+
+    Recorded arguments and results are kept alive until they are pushed
+    out of the buffer or fib.clear_trace() is called. Buffers of finished
+    threads are dropped after they are dumped or when a new thread starts
+    calling fib.
     """
 
+    if size is not None and size < 1:
+        raise ValueError('size should be at least 1, not {}'.format(size))
+    if sample < 1:
+        raise ValueError('sample should be at least 1, not {}'.format(sample))
+
     def log_trace(func):
+        if size is not None:
+            return _ring_trace(func, filler, size, sample)
+
         def wrapper(*args):
             const_args = ",".join(str(x) for x in args)
             print "{} --> {}({})".format(
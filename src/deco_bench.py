@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks for decorators from deco.py: overhead per call in ns for hits
+# and misses, memory per cached entry, scaling with size and number of
+# arguments and stacks of decorators from deco.main. Results can be saved
+# as JSON and compared with a saved baseline to catch regressions.
+#
+# $python deco_bench.py
+# $python deco_bench.py --output bench.json
+# $python deco_bench.py --baseline bench.json --tolerance 0.2 \
+#     --fast-tolerance 1.0
+
+import gc
+import json
+import operator
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import types
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from functools import update_wrapper, wraps
+from multiprocessing import Pool
+
+import deco
+
+NUMBER = 100000  # calls per measurement
+MEMORY_ENTRIES = 100000  # entries to measure memory per cached entry
+ARG_SIZES = (1, 10, 100, 1000)
+N_ARY_SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+LEGACY_N_ARY_LIMIT = 100  # it recurses once per argument
+N_ARY_ARGS = 1000000  # arguments folded per measurement of a size
+REPEAT = 5  # measurements to take the best of
+FAST_LIMIT = 1e-5  # s, timings shorter than this are noisy
+FAST_TOLERANCE = 1.0  # allowed relative regression of such timings
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+
+def legacy_memo(func):
+    """memo before the cache got maxsize/ttl: kept to compare with"""
+    memo_store = {}
+
+    @wraps(func)
+    def wrapper(*args):
+        pickled = pickle.dumps(args)
+        if pickled in memo_store:
+            return memo_store[pickled]
+        else:
+            res = func(*args)
+            update_wrapper(wrapper, func)
+            memo_store[pickled] = res
+            return res
+
+    return wrapper
+
+
+def legacy_n_ary(func):
+    """n_ary before it became iterative: kept to compare with"""
+
+    def split_args(source_func, *args):
+        if len(args) == 1:
+            return args[0]
+        elif len(args) == 2:
+            return source_func(*args)
+        else:
+            return split_args(
+                source_func, args[0], split_args(source_func, *args[1:])
+            )
+
+    @wraps(func)
+    def wrapper(*args):
+        res = split_args(func, *args)
+        update_wrapper(wrapper, func)
+        return res
+
+    return wrapper
+
+
+def add(a, b):
+    return a + b
+
+
+def identity(*args):
+    return args
+
+
+def per_call(stmt, number=NUMBER):
+    """
+    :param stmt: function without arguments to measure
+    :return: ns per call
+    """
+    return min(timeit.repeat(stmt, number=number, repeat=REPEAT)) / number \
+        * 1e9
+
+
+@contextmanager
+def quiet():
+    """Redirect stdout to /dev/null (for printing trace)"""
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as sys.stdout:
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def deep_size(cached):
+    """
+    :param cached: memoized function
+    :return: bytes taken by objects referenced from the closure of cached,
+    functions, classes and modules are not counted
+    """
+    seen = set()
+    stack = [cell.cell_contents for cell in cached.__closure__ or ()]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def bench_memo_hit(memo, args, number=NUMBER):
+    cached = memo(identity)
+    cached(*args)
+    return per_call(lambda: cached(*args), number)
+
+
+def bench_memo_miss(memo, number=NUMBER):
+    cached = memo(add)
+    counter = iter(xrange(number * REPEAT))
+    return per_call(lambda: cached(next(counter), 1), number)
+
+
+def bench_memo_memory(memo, entries=MEMORY_ENTRIES):
+    """
+    :return: bytes per cached entry (int argument, shared value)
+    """
+    cached = memo(lambda x: None)
+    cached(-1)
+    before = deep_size(cached)
+    for x in xrange(entries):
+        cached(x)
+    return 1.0 * (deep_size(cached) - before) / entries
+
+
+def bench_memos(results, number):
+    tmp_dir = tempfile.mkdtemp()
+    memos = (
+        ('legacy_memo', legacy_memo),
+        ('memo', deco.memo),
+        ('memo_maxsize', deco.memo(maxsize=1000)),
+        ('memo_ttl', deco.memo(ttl=60)),
+        ('memo_threadsafe', deco.memo(threadsafe=True)),
+        ('memo_persist', deco.memo(persist=os.path.join(tmp_dir, 'memo.db'))),
+    )
+    for name, memo in memos:
+        results[name + '.hit_ns'] = bench_memo_hit(memo, (1, 2), number)
+        results[name + '.unhashable_hit_ns'] = bench_memo_hit(
+            memo, ([1], [2]), number)
+        # sqlite is too slow for the full number of misses
+        results[name + '.miss_ns'] = bench_memo_miss(
+            memo, number if name != 'memo_persist' else number // 100)
+    shutil.rmtree(tmp_dir)
+
+    for name, memo in memos[:-1]:
+        if name == 'memo_maxsize':
+            # all the entries have to fit
+            memo = deco.memo(maxsize=MEMORY_ENTRIES)
+        results[name + '.bytes_per_entry'] = bench_memo_memory(memo)
+
+    # scaling with the size of arguments
+    for size in ARG_SIZES:
+        calls = max(number // size, 100)
+        for name, memo in memos[:2]:
+            results['{}.hit_{}_ints_ns'.format(name, size)] = bench_memo_hit(
+                memo, tuple(range(size)), calls)
+            results['{}.hit_list_of_{}_ints_ns'.format(name, size)] = \
+                bench_memo_hit(memo, (range(size),), calls)
+
+
+def bench_calls(results, number):
+    results['plain.call_ns'] = per_call(lambda: add(1, 2), number)
+
+    counted = deco.countcalls(add)
+    results['countcalls.call_ns'] = per_call(lambda: counted(1, 2), number)
+    deco.set_instrumentation(False)
+    results['countcalls.disabled_call_ns'] = per_call(
+        lambda: counted(1, 2), number)
+    deco.set_instrumentation(True)
+
+    traced = deco.trace('__')(add)
+    with quiet():
+        results['trace.call_ns'] = per_call(lambda: traced(1, 2), number)
+    ring = deco.trace('__', size=1000)(add)
+    results['trace_ring.call_ns'] = per_call(lambda: ring(1, 2), number)
+    sampled = deco.trace('__', size=1000, sample=100)(add)
+    results['trace_ring_sampled.call_ns'] = per_call(
+        lambda: sampled(1, 2), number)
+
+    legacy = legacy_n_ary(add)
+    results['legacy_n_ary.call_ns'] = per_call(lambda: legacy(1, 2), number)
+    n_ary = deco.n_ary(add)
+    results['n_ary.call_ns'] = per_call(lambda: n_ary(1, 2), number)
+
+
+def bench_n_ary(results, sizes=N_ARY_SIZES):
+    pool = Pool()
+    n_aries = (
+        ('legacy_n_ary', legacy_n_ary(operator.add), LEGACY_N_ARY_LIMIT),
+        ('n_ary', deco.n_ary(operator.add), None),
+        ('n_ary_pool', deco.n_ary(operator.add, associative=True,
+                                  pool=pool), None),
+    )
+    for size in sizes:
+        args = range(size)
+        number = max(N_ARY_ARGS // size, 1)
+        for name, n_ary, limit in n_aries:
+            if limit is not None and size > limit:
+                continue
+            best = min(timeit.repeat(lambda: n_ary(*args), number=number,
+                                     repeat=REPEAT))
+            results['{}.args_{}_s'.format(name, size)] = best / number
+    pool.close()
+
+
+def bench_stacks(results, number):
+    """Stacks of decorators from deco.main"""
+    results['stack_foo.hit_ns'] = per_call(lambda: deco.foo(4, 3, 2), number)
+    results['stack_bar.hit_ns'] = per_call(lambda: deco.bar(4, 3, 2), number)
+    with quiet():
+        results['stack_fib.hit_ns'] = per_call(lambda: deco.fib(20), number)
+
+
+def run(number=NUMBER):
+    """
+    :return: dict with results: name of a measurement -> value
+    """
+    results = {}
+    bench_calls(results, number)
+    bench_memos(results, number)
+    bench_n_ary(results)
+    bench_stacks(results, number)
+    return results
+
+
+def in_seconds(name, value):
+    """
+    :return: value of a timing in seconds or None if it's not a timing
+    """
+    if name.endswith('_ns'):
+        return value * 1e-9
+    if name.endswith('_s'):
+        return value
+
+
+def compare(results, baseline, tolerance, fast_tolerance=FAST_TOLERANCE):
+    """
+    :param results: dict with results
+    :param baseline: dict with results to compare with
+    :param tolerance: allowed relative growth of a value
+    :param fast_tolerance: allowed relative growth of a timing shorter than
+    FAST_LIMIT
+    :return: list of (name, baseline value, value) that grew too much
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        old = baseline.get(name)
+        if value is None or old is None:
+            continue
+        seconds = in_seconds(name, old)
+        allowed = fast_tolerance if seconds is not None and \
+            seconds < FAST_LIMIT else tolerance
+        if value > old * (1 + allowed):
+            regressions.append((name, old, value))
+    return regressions
+
+
+def get_args():
+    parser = ArgumentParser(description="Benchmarks for deco.py")
+    parser.add_argument("--number", action='store', type=int, default=NUMBER,
+                        help="Set the number of calls per measurement")
+    parser.add_argument("-o", "--output", action='store',
+                        help="Set the path to save results as JSON")
+    parser.add_argument("-b", "--baseline", action='store',
+                        help="Set the path to JSON results to compare with")
+    parser.add_argument("--tolerance", action='store', type=float,
+                        default=0.2,
+                        help="Set the allowed relative regression")
+    parser.add_argument("--fast-tolerance", action='store', type=float,
+                        default=FAST_TOLERANCE,
+                        help="Set the allowed relative regression of "
+                             "timings shorter than 10 us")
+    return parser.parse_args()
+
+
+def main(args):
+    results = run(args.number)
+    for name, value in sorted(results.items()):
+        print "{:<40} {}".format(
+            name, '-' if value is None else '{:.6g}'.format(value))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': time.time(),
+                'python': platform.python_version(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance,
+                              args.fast_tolerance)
+        for name, old, value in regressions:
+            print "Regression {}: {:.6g} -> {:.6g}".format(name, old, value)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(get_args())
@@ -10,6 +10,7 @@
 import gzip
 import json
 import logging
+import math
 import re
 import sys
 import time
@@ -19,8 +20,12 @@ from os import listdir
 from os import path
 from os import utime
 
+from deco import instrument
+from deco import stats_report
+
 CONFIG = {
     "REPORT_SIZE": 1000,
+    "REPORT_INLINE_SIZE": 1000,
     "REPORT_DIR": "./reports",
     "LOG_DIR": "./log",
 }
@@ -29,8 +34,12 @@ SAMPLE = 'nginx-access-ui.log-'
 RE_TIME = '[-](\d{8})[.]'
 BASE_REPORT_NAME = 'report.html'
 BASE_REPORT_REPL = '$table_json'
+BASE_REPORT_SIDECAR_REPL = '$table_sidecar'
 PREC = 5  # precision for round stat values
 PROC_ERRORS_LIMIT = 0.01
+SAMPLE_BLOCK_SIZE = 64 * 1024  # bytes of the log in a block for sampling
+SAMPLE_READ_SIZE = 1024 * 1024  # bytes to read at once to skip in .gz log
+Z_95 = 1.96  # z-score for 95% confidence intervals
 
 
 def get_config():
@@ -38,13 +47,21 @@ def get_config():
     parser.add_argument("-c", "--config", action='store',
                         default="config.json",
                         help="Set the path for config.json")
+    parser.add_argument("-s", "--sample", action='store', type=float,
+                        default=None,
+                        help="Set the rate (0 < RATE <= 1) of the log to "
+                             "parse for a fast approximate report")
     args = parser.parse_args()
 
     if not path.isfile(args.config):
         print "File " + args.config + " doesn't exist"
         return
 
-    return args.config
+    if args.sample is not None and not 0 < args.sample <= 1:
+        print "Sample rate should be in (0, 1]"
+        return
+
+    return args
 
 
 def set_logging(log_filename):
@@ -69,6 +86,7 @@ def merge_two_config(a, b):
     return c
 
 
+@instrument
 def get_path_last_log(logs_path):
     """
     :param logs_path: path for log's directory
@@ -95,13 +113,17 @@ def get_path_last_log(logs_path):
     return log_path, parsed_time
 
 
-def get_report_name(report_path, parsed_time):
+def get_report_name(report_path, parsed_time, sample=False):
     """
     :param report_path: path to report
     :param parsed_time: date and time for report
+    :param sample: report is approximate, made from a sample of the log
     :return: path to report with name
     """
-    report_name = "report-{}.html".format(parsed_time)
+    if sample:
+        report_name = "report-{}-sample.html".format(parsed_time)
+    else:
+        report_name = "report-{}.html".format(parsed_time)
     return path.join(report_path, report_name)
 
 
@@ -118,6 +140,7 @@ def get_median(source_list):
         return source_list[med]
 
 
+@instrument
 def get_stat(data):
     """
     :param data: dict with urls and lists their request_time, total numbers of
@@ -139,10 +162,54 @@ def get_stat(data):
             'time_med': round(get_median(val), PREC)
 
         })
+        if 'sample' in data:
+            add_estimates(stat[-1], data['sample'])
     stat.sort(key=lambda d: d['time_sum'], reverse=True)
     return stat
 
 
+def get_cluster_ci(total, total_sq, number_blocks, overall_blocks):
+    """
+    Half-width of 95% confidence interval of overall_blocks / number_blocks *
+    total - the estimate of a sum over all blocks of the log by the blocks
+    sampled
+    :param total: sum of values over the blocks sampled
+    :param total_sq: sum of squares of values over the blocks sampled
+    :param number_blocks: number of blocks sampled
+    :param overall_blocks: number of blocks in the log
+    :return: float half-width or None if it can't be estimated
+    """
+    if number_blocks < 2:
+        return
+    mean = 1.0 * total / number_blocks
+    variance = max(total_sq - number_blocks * mean * mean, 0.0) / (
+        number_blocks - 1)
+    fpc = 1.0 - 1.0 * number_blocks / overall_blocks
+    return Z_95 * overall_blocks * math.sqrt(
+        max(fpc, 0.0) * variance / number_blocks)
+
+
+def add_estimates(row, sample):
+    """
+    Scale count and time_sum of a row of stat made from a sample of the log
+    to the whole log and add their 95% confidence intervals
+    :param row: dictionary with stat of url
+    :param sample: dict with number of blocks sampled, number of blocks in
+    the log and sums of count and time_sum (and of their squares) per block
+    for every url
+    """
+    number_blocks = sample['number_blocks']
+    overall_blocks = sample['overall_blocks']
+    scale = 1.0 * overall_blocks / number_blocks
+    count, count_sq, time_sum, time_sq = sample['blocks'][row['url']]
+    row['count'] = int(round(row['count'] * scale))
+    row['time_sum'] = row['time_sum'] * scale
+    count_ci = get_cluster_ci(count, count_sq, number_blocks, overall_blocks)
+    time_ci = get_cluster_ci(time_sum, time_sq, number_blocks, overall_blocks)
+    row['count_ci'] = None if count_ci is None else round(count_ci, PREC)
+    row['time_sum_ci'] = None if time_ci is None else round(time_ci, PREC)
+
+
 def get_by_line(log_path):
     """
     Generator for big logs - read by line
@@ -192,6 +259,7 @@ def get_request_time_from_line(line, line_number):
     return float(request_time[0])
 
 
+@instrument
 def parse_log(log_path):
     """
     :param log_path: path for log
@@ -229,13 +297,177 @@ def parse_log(log_path):
             }
 
 
-def get_html_report(stat, base_report_path):
+def skip_bytes(log, size, file_size=None):
+    """
+    Skip size bytes of the log: seek in a plain log, read in bulk (without
+    splitting into lines) in a gzipped one as it can't seek
+    :param log: file object of the log
+    :param size: bytes to skip
+    :param file_size: size of a plain log, None for a gzipped one
+    :return: number of bytes skipped, less than size at the end of the log
+    """
+    if file_size is not None:
+        position = log.tell()
+        size = max(min(size, file_size - position), 0)
+        log.seek(position + size)
+        return size
+    skipped = 0
+    while skipped < size:
+        data = log.read(min(SAMPLE_READ_SIZE, size - skipped))
+        if not data:
+            break
+        skipped += len(data)
+    return skipped
+
+
+def get_sampled_blocks(log_path, rate, info,
+                       block_size=SAMPLE_BLOCK_SIZE):
+    """
+    Generator for a sample of the log: the log is split into blocks of
+    block_size bytes and every round(1 / rate)-th block is read. A line
+    belongs to the block it starts in, so the part of the block before its
+    first line is skipped together with the blocks not sampled. A gzipped
+    log is unpacked as a whole, but only the lines of the blocks sampled
+    are read one by one.
+    :param log_path: path to log
+    :param rate: rate of the log to read, 0 < rate <= 1
+    :param info: dict to fill with overall_blocks (number of blocks in the
+    log) and number_blocks (number of blocks read) when the log is read
+    :param block_size: bytes in a block
+    :return: next list of lines of a block
+    """
+    step = max(1, int(round(1.0 / rate)))
+    gzipped = log_path.endswith('.gz')
+    file_size = None if gzipped else path.getsize(log_path)
+    opener = gzip.open if gzipped else open
+    position = 0  # offset in the (unpacked) log
+    block = 0
+    eof = False
+    with opener(log_path, 'rb') as log:
+        while not eof:
+            start = block * block_size
+            end = start + block_size
+            if position < start:
+                # skip to the end of the line that has byte start - 1
+                position += skip_bytes(log, start - 1 - position, file_size)
+                line = log.readline() if position == start - 1 else ''
+                if not line:
+                    break
+                position += len(line)
+            lines = []
+            while position < end:
+                line = log.readline()
+                if not line:
+                    eof = True
+                    break
+                position += len(line)
+                lines.append(line)
+            if lines:
+                yield lines
+            block += step
+    info['overall_blocks'] = (position + block_size - 1) // block_size
+    info['number_blocks'] = (info['overall_blocks'] + step - 1) // step
+
+
+@instrument
+def parse_log_sample(log_path, rate):
+    """
+    parse_log for a sample of the log, see get_sampled_blocks
+    :param log_path: path for log
+    :param rate: rate of the log to parse, 0 < rate <= 1
+    :return: list with stat as parse_log does and 'sample' with the data to
+    scale stat to the whole log
+    """
+    number_urls = 0
+    overall_request_time = 0
+    number_lines = 0
+    number_errors = 0
+
+    data = {}
+    blocks = {}  # url -> sums of count, count ** 2, time, time ** 2 by block
+    info = {}
+    for lines in get_sampled_blocks(log_path, rate, info):
+        block_data = {}  # url -> count and time in the block
+        for line in lines:
+            number_lines += 1
+            url = get_url_from_line(line, number_lines)
+            request_time = get_request_time_from_line(line, number_lines)
+            if not (url and request_time):
+                number_errors += 1
+                continue
+            data.setdefault(url, []).append(request_time)
+            block_stat = block_data.setdefault(url, [0, 0.0])
+            block_stat[0] += 1
+            block_stat[1] += request_time
+            number_urls += 1
+            overall_request_time += request_time
+        for url, (count, request_time) in block_data.iteritems():
+            sums = blocks.setdefault(url, [0, 0, 0.0, 0.0])
+            sums[0] += count
+            sums[1] += count * count
+            sums[2] += request_time
+            sums[3] += request_time * request_time
+
+    if number_lines:
+        percentage_errors = 1.0 * number_errors / number_lines * 100.0
+        if percentage_errors > PROC_ERRORS_LIMIT:
+            logging.info(
+                'Number of errors due to parsing {}'.format(number_errors)
+            )
+    logging.info('Sampled {} of {} blocks of the log'.format(
+        info['number_blocks'], info['overall_blocks']))
+
+    return {'counter': data,
+            'number_urls': number_urls,
+            'overall_request_time': overall_request_time,
+            'sample': {
+                'number_blocks': info['number_blocks'],
+                'overall_blocks': info['overall_blocks'],
+                'blocks': blocks
+            }
+            }
+
+
+@instrument
+def get_html_report(stat, base_report_path, sidecar_name=None):
+    """
+    :param stat: list of dictionary with stat to inline into report
+    :param base_report_path: path to report template
+    :param sidecar_name: name of sidecar file with the rest of stat
+    :return: str with html
+    """
     with open(base_report_path) as f:
         html = f.read()
     html = html.replace(BASE_REPORT_REPL, json.dumps(stat))
+    html = html.replace(BASE_REPORT_SIDECAR_REPL, json.dumps(sidecar_name))
     return html
 
 
+def get_sidecar_name(report_path):
+    """
+    :param report_path: path to report
+    :return: path to sidecar with the rows that aren't inlined into report
+    """
+    return path.splitext(report_path)[0] + '.json.gz'
+
+
+@instrument
+def write_sidecar(stat, sidecar_path, number_rows):
+    """
+    Save rows as gzipped lines of JSON, so report can read them by chunks:
+    the first line is {"columns": [...], "rows": number_rows}, every next one
+    is a list of values of a row
+    :param stat: list of dictionary with stat
+    :param sidecar_path: path to sidecar
+    :param number_rows: total number of rows in report
+    """
+    columns = sorted(stat[0]) if stat else []
+    with gzip.open(sidecar_path, 'wb') as f:
+        f.write(json.dumps({'columns': columns, 'rows': number_rows}) + '\n')
+        for row in stat:
+            f.write(json.dumps([row[c] for c in columns]) + '\n')
+
+
 def update_ts(ts_path):
     with open(ts_path, "a") as f:
         finish_time = time.time()
@@ -249,7 +481,9 @@ def main(settings):
     # if we don't have any logs - just stop analyzing without errors
     if not log_path:
         return
-    report_path = get_report_name(settings['REPORT_DIR'], parsed_time)
+    sample_rate = settings.get('SAMPLE_RATE')
+    report_path = get_report_name(settings['REPORT_DIR'], parsed_time,
+                                  sample=bool(sample_rate))
 
     # exit if report exists
     if path.exists(report_path):
@@ -257,30 +491,46 @@ def main(settings):
         return
     base_report_path = path.join(settings['REPORT_DIR'], BASE_REPORT_NAME)
 
-    # fetch data
-    data_from_log = parse_log(log_path)
+    # fetch data, only a sample of the log for an approximate report
+    if sample_rate:
+        data_from_log = parse_log_sample(log_path, sample_rate)
+    else:
+        data_from_log = parse_log(log_path)
 
     # collected statistic
     stat = get_stat(data_from_log)
 
-    # create report from stat
+    # create report from stat, large reports get the most of rows from
+    # sidecar file
+    stat = stat[:settings['REPORT_SIZE']]
+    inline_size = settings['REPORT_INLINE_SIZE']
+    sidecar_name = None
+    if len(stat) > inline_size:
+        sidecar_path = get_sidecar_name(report_path)
+        write_sidecar(stat[inline_size:], sidecar_path, len(stat))
+        sidecar_name = path.basename(sidecar_path)
     html_report = get_html_report(
-        stat[:settings['REPORT_SIZE']],
-        base_report_path
+        stat[:inline_size],
+        base_report_path,
+        sidecar_name
     )
 
     # save report with statistic to file
     with open(report_path, "w") as f:
         f.write(html_report)
 
-    # update ts file
-    update_ts(settings.get('TS_FILE', None))
+    # update ts file, an approximate report is not a finished analysis
+    if not sample_rate:
+        update_ts(settings.get('TS_FILE', None))
+
+    logging.info('Timings of the stages:\n{}'.format(stats_report()))
 
 
 if __name__ == "__main__":
-    config_file = get_config()
-    if not config_file:
+    args = get_config()
+    if not args:
         sys.exit(-1)
+    config_file = args.config
 
     try:
         with open(config_file) as json_data_file:
@@ -290,6 +540,8 @@ if __name__ == "__main__":
         sys.exit(-1)
 
     merged_config = merge_two_config(CONFIG, config_from_file)
+    if args.sample is not None:
+        merged_config['SAMPLE_RATE'] = args.sample
 
     set_logging(merged_config.get('LOG_FILE', None))
     logging.info('** Start analyzing... **')
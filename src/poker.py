@@ -108,16 +108,18 @@ def two_pair(ranks):
     return first_pair, second_pair
 
 
-def best_hand(hand):
-    """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт """
+def best_hand(hand, rank=hand_rank):
+    """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт
+    :param rank: функция ранга 'руки', например poker_table.hand_value
+    """
     list_hands = []
     for full_hand in combinations(hand, 5):
-        list_hands.append((hand_rank(list(full_hand)), list(full_hand)))
+        list_hands.append((rank(list(full_hand)), list(full_hand)))
     list_hands.sort(key=lambda x: (x[0], x[1]), reverse=True)
     return list_hands[0][1]
 
 
-def best_wild_hand(hand):
+def best_wild_hand(hand, rank=hand_rank):
     """best_hand но с джокерами"""
 
     list_hands = []
@@ -137,11 +139,11 @@ def best_wild_hand(hand):
 
             for replaced_hand in replaced_joker_hands:
                 list_hands.append(
-                    (hand_rank(list(replaced_hand)), list(replaced_hand))
+                    (rank(list(replaced_hand)), list(replaced_hand))
                 )
 
         else:
-            list_hands.append((hand_rank(list(full_hand)), list(full_hand)))
+            list_hands.append((rank(list(full_hand)), list(full_hand)))
 
     list_hands.sort(key=lambda x: (x[0], x[1]), reverse=True)
     return list_hands[0][1]
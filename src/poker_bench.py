@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Correctness and speed harness for poker hand evaluators.
+#
+# An evaluator is a function of 5 cards like hand_rank: the bigger value -
+# the better hand. It is checked against hand_rank on 5-card hands and via
+# best_hand/best_wild_hand on 7-card hands (with or without jokers). The
+# reference itself is checked against an independent classification, so its
+# known mistakes (e.g. straight only checks ranks[0] - ranks[-1] == 4) are
+# reported too.
+#
+# $python poker_bench.py
+# $python poker_bench.py --size 7 --jokers 2 --sample 2000
+# $python poker_bench.py --size 5 --exhaustive \
+#     --evaluator poker_table:hand_value
+
+import random
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from importlib import import_module
+from itertools import combinations
+
+from poker import DICT_RANK
+from poker import best_hand
+from poker import best_wild_hand
+from poker import hand_rank
+
+DECK = [r + s for r in '23456789TJQKA' for s in 'SCHD']
+JOKERS = ['?B', '?R']
+CATEGORIES = [
+    'high card', 'pair', 'two pairs', 'three of a kind', 'straight', 'flush',
+    'full house', 'four of a kind', 'straight flush'
+]
+DEFAULT_EVALUATOR = 'poker_table:hand_value'
+EXAMPLES_LIMIT = 3  # number of examples to show for each kind of mismatch
+
+
+def iter_hands(size, jokers=0, sample=None, seed=None):
+    """
+    Generator for hands
+    :param size: number of cards in a hand
+    :param jokers: number of jokers in the deck
+    :param sample: number of random hands, all hands if None
+    :param seed: seed for random hands
+    :return: next hand
+    """
+    deck = DECK + JOKERS[:jokers]
+    if sample is None:
+        for hand in combinations(deck, size):
+            yield list(hand)
+        return
+    rnd = random.Random(seed)
+    for _ in xrange(sample):
+        yield rnd.sample(deck, size)
+
+
+def classify(hand):
+    """
+    Independent classification of 5 cards (an ace may be low in a straight)
+    :param hand: 5 cards
+    :return: category, the index in CATEGORIES
+    """
+    ranks = sorted(DICT_RANK[x[0]] for x in hand)
+    counts = sorted(Counter(ranks).values(), reverse=True)
+    is_flush = len(set(x[1] for x in hand)) == 1
+    is_straight = counts[0] == 1 and (
+        ranks[-1] - ranks[0] == 4 or ranks == [2, 3, 4, 5, 14]
+    )
+    if is_straight and is_flush:
+        return 8
+    if counts[0] == 4:
+        return 7
+    if counts[:2] == [3, 2]:
+        return 6
+    if is_flush:
+        return 5
+    if is_straight:
+        return 4
+    if counts[0] == 3:
+        return 3
+    if counts[:2] == [2, 2]:
+        return 2
+    if counts[0] == 2:
+        return 1
+    return 0
+
+
+class Mismatches(object):
+    """Counter of mismatches by kind with a few examples of each"""
+
+    def __init__(self):
+        self.counter = Counter()
+        self.examples = {}
+
+    def add(self, kind, example):
+        self.counter[kind] += 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < EXAMPLES_LIMIT:
+            examples.append(example)
+
+    def __len__(self):
+        return sum(self.counter.values())
+
+    def report(self, title):
+        print "{}: {}".format(title, len(self) or 'OK')
+        for kind, number in self.counter.most_common():
+            print "  {} - {}".format(kind, number)
+            for example in self.examples[kind]:
+                print "    {}".format(example)
+
+
+def check_reference(hands):
+    """
+    Check hand_rank against the independent classification
+    :param hands: iterable of 5-card hands
+    :return: Mismatches
+    """
+    anomalies = Mismatches()
+    for hand in hands:
+        expected = classify(hand)
+        got = hand_rank(hand)[0]
+        if got != expected:
+            anomalies.add(
+                '{} ranked as {}'.format(CATEGORIES[expected],
+                                         CATEGORIES[got]),
+                ' '.join(hand)
+            )
+    return anomalies
+
+
+def check_evaluator(evaluator, hands):
+    """
+    Check that evaluator orders 5-card hands exactly as hand_rank does
+    :param evaluator: function of 5 cards
+    :param hands: iterable of 5-card hands
+    :return: Mismatches
+    """
+    mismatches = Mismatches()
+    seen = {}  # hand_rank value -> (evaluator value, hand)
+    for hand in hands:
+        reference = hand_rank(hand)
+        reference = tuple(tuple(x) if isinstance(x, list) else x
+                          for x in reference)
+        value = evaluator(hand)
+        if reference not in seen:
+            seen[reference] = (value, hand)
+        elif seen[reference][0] != value:
+            mismatches.add('equal hands valued differently', '{} / {}'.format(
+                ' '.join(seen[reference][1]), ' '.join(hand)))
+    ordered = sorted(seen.items())
+    for (_, (worse, worse_hand)), (_, (better, better_hand)) in zip(
+            ordered, ordered[1:]):
+        if not worse < better:
+            mismatches.add(
+                'better hand is not valued higher', '{} < {}'.format(
+                    ' '.join(worse_hand), ' '.join(better_hand)))
+    return mismatches
+
+
+def check_best(evaluator, hands, wild=False):
+    """
+    Check best_hand (best_wild_hand) with evaluator against hand_rank
+    :param evaluator: function of 5 cards
+    :param hands: iterable of hands
+    :param wild: use best_wild_hand
+    :return: Mismatches
+    """
+    best = best_wild_hand if wild else best_hand
+    mismatches = Mismatches()
+    for hand in hands:
+        expected = best(hand)
+        got = best(hand, evaluator)
+        if got != expected:
+            mismatches.add('another best hand', '{}: {} instead of {}'.format(
+                ' '.join(hand), ' '.join(got), ' '.join(expected)))
+    return mismatches
+
+
+def measure(func, hands):
+    """
+    Allocations per evaluation are not measured: Python 2.7 has no
+    tracemalloc and gc only counts objects left alive, not allocated
+    :param func: function of a hand
+    :param hands: list of hands
+    :return: hands per second
+    """
+    start = time.time()
+    for hand in hands:
+        func(hand)
+    elapsed = time.time() - start
+    return len(hands) / elapsed if elapsed else float('inf')
+
+
+def load_evaluator(name):
+    """
+    :param name: 'module:function'
+    :return: function
+    """
+    module_name, func_name = name.split(':')
+    return getattr(import_module(module_name), func_name)
+
+
+def get_args():
+    parser = ArgumentParser(description="Poker evaluators benchmark")
+    parser.add_argument("--evaluator", action='store',
+                        default=DEFAULT_EVALUATOR,
+                        help="Set the evaluator as module:function")
+    parser.add_argument("--size", action='store', type=int, default=5,
+                        choices=[5, 7], help="Set the number of cards")
+    parser.add_argument("--jokers", action='store', type=int, default=0,
+                        choices=[0, 1, 2], help="Set the number of jokers")
+    parser.add_argument("--sample", action='store', type=int, default=2000,
+                        help="Set the number of random hands")
+    parser.add_argument("--seed", action='store', type=int, default=None,
+                        help="Set the seed for random hands")
+    parser.add_argument("--exhaustive", action='store_true',
+                        help="Check all hands instead of random ones")
+    return parser.parse_args()
+
+
+def main(args):
+    evaluator = load_evaluator(args.evaluator)
+    sample = None if args.exhaustive else args.sample
+    hands = list(iter_hands(args.size, args.jokers, sample, args.seed))
+    print "{} hands of {} cards with {} jokers".format(
+        len(hands), args.size, args.jokers)
+
+    if args.size == 5 and not args.jokers:
+        reference = hand_rank
+        tested = evaluator
+        check_reference(hands).report('hand_rank anomalies')
+        check_evaluator(evaluator, hands).report(
+            '{} mismatches'.format(args.evaluator))
+    else:
+        wild = bool(args.jokers)
+        best = best_wild_hand if wild else best_hand
+        reference = best
+
+        def tested(hand):
+            return best(hand, evaluator)
+
+        five_card_hands = set()
+        for hand in hands:
+            five_card_hands.update(
+                x for x in combinations(sorted(hand), 5)
+                if not set(x) & set(JOKERS)
+            )
+        check_reference([list(x) for x in five_card_hands]).report(
+            'hand_rank anomalies')
+        check_best(evaluator, hands, wild).report(
+            '{} with {} mismatches'.format(best.__name__, args.evaluator))
+
+    for name, func in (('reference', reference), (args.evaluator, tested)):
+        print "{}: {:.0f} hands/sec".format(name, measure(func, hands))
+    print "Allocations per evaluation: n/a on Python 2.7"
+
+
+if __name__ == '__main__':
+    main(get_args())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Precomputed rank tables for 5-card hands.
+#
+# Every 5-card hand is reduced to its sorted ranks (4 bits per rank, 20 bits
+# per hand) and a flush flag. For every such key the table stores an ordinal
+# of hand_rank's value: equal hands get equal ordinals and a better hand
+# always gets a bigger one, so the ordinal can be used anywhere hand_rank is.
+#
+# The tables are generated once into a versioned binary file and mapped
+# read-only on import, so forked and spawned workers share the same pages
+# instead of rebuilding (and holding) their own copy:
+#
+# $python poker_table.py
+# $python poker_table.py -o /tmp/poker_ranks.bin
+
+import mmap
+import os
+import struct
+import sys
+import warnings
+from argparse import ArgumentParser
+from array import array
+from itertools import combinations_with_replacement
+from os import path
+
+from poker import DICT_RANK
+from poker import hand_rank
+
+TABLE_MAGIC = b'PKRT'
+TABLE_VERSION = 1
+TABLE_FILE = path.join(path.dirname(path.abspath(__file__)), 'poker_ranks.bin')
+
+RANK_BITS = 4
+KEY_BITS = RANK_BITS * 5
+KEY_SPACE = 1 << KEY_BITS  # entries per table: one with flush, one without
+# magic, version, bytes per entry, bits per key, number of ordinals
+HEADER = struct.Struct('<4sHHII')
+ENTRY = struct.Struct('<H')
+
+SUITS = 'SCHDS'  # suits for a non-flush hand: never all the same
+
+
+def pack_ranks(ranks):
+    """
+    :param ranks: ranks sorted from the biggest to the smallest
+    :return: int key of the ranks
+    """
+    key = 0
+    for rank in ranks:
+        key = (key << RANK_BITS) | rank
+    return key
+
+
+def iter_rank_classes():
+    """
+    Generator for all 5-card rank combinations possible in a deck with
+    4 suits (no five of a kind)
+    :return: next ranks sorted from the biggest to the smallest
+    """
+    all_ranks = sorted(DICT_RANK.values(), reverse=True)
+    for ranks in combinations_with_replacement(all_ranks, 5):
+        if ranks.count(ranks[0]) == 5:
+            continue
+        yield list(ranks)
+
+
+def freeze(rank):
+    """
+    :param rank: value of hand_rank
+    :return: the same value with lists replaced by tuples
+    """
+    return tuple(tuple(x) if isinstance(x, list) else x for x in rank)
+
+
+def build_table():
+    """
+    Build tables with hand_rank as a reference
+    :return: bytes with header and both tables
+    """
+    rank_by_key = {}
+    inv = dict((v, k) for k, v in DICT_RANK.items())
+    for ranks in iter_rank_classes():
+        cards = [inv[r] for r in ranks]
+        key = pack_ranks(ranks)
+        hand = [c + s for c, s in zip(cards, SUITS)]
+        rank_by_key[key] = freeze(hand_rank(hand))
+        # a flush is possible only with 5 different ranks
+        if len(set(ranks)) == 5:
+            hand = [c + 'S' for c in cards]
+            rank_by_key[KEY_SPACE | key] = freeze(hand_rank(hand))
+
+    ranks = sorted(set(rank_by_key.values()))
+    ordinals = dict((rank, i) for i, rank in enumerate(ranks, 1))
+    # 0 is left for keys that can't be met in a game
+    entries = array('H', [0]) * (2 * KEY_SPACE)
+    for key, rank in rank_by_key.items():
+        entries[key] = ordinals[rank]
+    if sys.byteorder != 'little':
+        entries.byteswap()
+
+    header = HEADER.pack(
+        TABLE_MAGIC, TABLE_VERSION, ENTRY.size, KEY_BITS, len(ordinals)
+    )
+    return header + entries.tostring()
+
+
+def write_table(table_path=TABLE_FILE, table=None):
+    """
+    Generate tables and save them to file. The file is replaced atomically,
+    so the processes that have the old one mapped are not affected
+    :param table_path: path to file with tables
+    :param table: tables built by build_table(), built if None
+    :return: path to file with tables
+    """
+    if table is None:
+        table = build_table()
+    tmp_path = '{}.{}.tmp'.format(table_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(table)
+        os.rename(tmp_path, table_path)
+    except (IOError, OSError):
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return table_path
+
+
+def check_header(buf):
+    """
+    :param buf: bytes or mmap with tables
+    :return: number of ordinals in the tables
+    """
+    if len(buf) < HEADER.size:
+        raise ValueError('Rank table is too short')
+    magic, version, entry_size, key_bits, number_ordinals = \
+        HEADER.unpack_from(buf, 0)
+    if magic != TABLE_MAGIC:
+        raise ValueError('Not a rank table')
+    if (version, entry_size, key_bits) != (TABLE_VERSION, ENTRY.size,
+                                           KEY_BITS):
+        raise ValueError(
+            'Rank table version {} is not supported, expected {}'.format(
+                version, TABLE_VERSION)
+        )
+    if len(buf) != HEADER.size + 2 * KEY_SPACE * ENTRY.size:
+        raise ValueError('Rank table is truncated')
+    return number_ordinals
+
+
+def open_table(table_path=TABLE_FILE):
+    """
+    Map the file with tables read-only
+    :param table_path: path to file with tables
+    :return: mmap with tables or None if there is no such file or it's not
+    of this version (with a warning), get_table() rebuilds it then
+    """
+    if not path.isfile(table_path):
+        return
+    with open(table_path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            buf = None
+    try:
+        if buf is None:
+            raise ValueError('Rank table is empty')
+        check_header(buf)
+    except ValueError as e:
+        if buf is not None:
+            buf.close()
+        warnings.warn('{}: {}, it will be rebuilt'.format(table_path, e))
+        return
+    return buf
+
+
+# mapped once on import, the file is generated by write_table()
+TABLE = open_table()
+
+
+def get_table():
+    """
+    Tables are built on the first use if there is no file and saved to
+    TABLE_FILE, so the next processes map the file instead of building
+    their own copy. If the file can't be written the tables are kept in
+    memory of this process only (with a warning)
+    :return: mapped tables
+    """
+    global TABLE
+    if TABLE is None:
+        table = build_table()
+        try:
+            TABLE = open_table(write_table(TABLE_FILE, table))
+        except (IOError, OSError) as e:
+            warnings.warn(
+                'Rank table is not saved to {} ({}), every process builds '
+                'its own copy; run poker_table.py to generate it'.format(
+                    TABLE_FILE, e)
+            )
+            TABLE = table
+    return TABLE
+
+
+def hand_value(hand):
+    """
+    Fast replacement for hand_rank
+    :param hand: 5 cards
+    :return: int ordinal of hand_rank's value, the bigger the better
+    """
+    table = TABLE if TABLE is not None else get_table()
+    ranks = sorted([DICT_RANK[x[0]] for x in hand], reverse=True)
+    # pack_ranks inlined
+    key = (ranks[0] << 16 | ranks[1] << 12 | ranks[2] << 8 | ranks[3] << 4 |
+           ranks[4])
+    suit = hand[0][1]
+    if all(x[1] == suit for x in hand):
+        key |= KEY_SPACE
+    return ENTRY.unpack_from(table, HEADER.size + key * ENTRY.size)[0]
+
+
+def test_hand_value():
+    print "test_hand_value..."
+    hands = [
+        "6C 7C 8C 9C TC".split(),  # straight flush
+        "7C 7D 7H 7S JD".split(),  # four of a kind
+        "TD TC TH 8C 8S".split(),  # full house
+        "2C 5C 9C JC AC".split(),  # flush
+        "6C 7D 8C 9C TC".split(),  # straight
+        "TD TC TH 8C 7S".split(),  # three of a kind
+        "TD TC 8H 8C 7S".split(),  # two pairs
+        "TD TC 8H 9C 7S".split(),  # pair
+        "2D 5C 8H 9C KS".split(),  # high card
+    ]
+    for better, worse in zip(hands, hands[1:]):
+        assert hand_value(better) > hand_value(worse)
+        assert hand_rank(better) > hand_rank(worse)
+    assert (hand_value("TD TC 8H 9C 7S".split()) ==
+            hand_value("TS TH 8D 9S 7C".split()))
+    print 'OK'
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Generate poker rank tables")
+    parser.add_argument("-o", "--output", action='store', default=TABLE_FILE,
+                        help="Set the path for the file with tables")
+    args = parser.parse_args()
+    print "Tables are saved to " + write_table(args.output)
+    test_hand_value()
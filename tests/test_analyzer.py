@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 import src.log_analyzer as la
@@ -53,6 +58,9 @@ class AnalyzerTest(unittest.TestCase):
         # good log name
         self.assertEqual(
             la.get_report_name('', '2017.06.27'), 'report-2017.06.27.html')
+        self.assertEqual(
+            la.get_report_name('', '2017.06.27', sample=True),
+            'report-2017.06.27-sample.html')
 
     def test_get_median(self):
         # good source
@@ -174,5 +182,126 @@ class StatAnalyzerTest(unittest.TestCase):
         )
 
 
+class ReportAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_html_report(self):
+        base_report_path = os.path.join(self.tmp_dir, 'report.html')
+        with open(base_report_path, 'w') as f:
+            f.write('var table = $table_json; var sidecar = $table_sidecar;')
+        self.assertEqual(
+            la.get_html_report([{'url': '/a'}], base_report_path),
+            'var table = [{"url": "/a"}]; var sidecar = null;'
+        )
+        self.assertEqual(
+            la.get_html_report([], base_report_path, 'report.json.gz'),
+            'var table = []; var sidecar = "report.json.gz";'
+        )
+
+    def test_get_sidecar_name(self):
+        self.assertEqual(
+            la.get_sidecar_name('reports/report-2017.06.27.html'),
+            'reports/report-2017.06.27.json.gz'
+        )
+
+    def test_write_sidecar(self):
+        sidecar_path = os.path.join(self.tmp_dir, 'report.json.gz')
+        la.write_sidecar(
+            [{'url': '/a', 'count': 2}, {'url': '/b', 'count': 1}],
+            sidecar_path, 3
+        )
+        with gzip.open(sidecar_path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, [
+            {'columns': ['count', 'url'], 'rows': 3},
+            [2, '/a'],
+            [1, '/b'],
+        ])
+
+
+class SampleAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lines = ['line {:04d}\n'.format(i) for i in range(100)]
+        self.log_path = os.path.join(self.tmp_dir, 'access.log')
+        with open(self.log_path, 'w') as f:
+            f.writelines(self.lines)
+        self.gz_path = os.path.join(self.tmp_dir, 'access.log.gz')
+        with gzip.open(self.gz_path, 'wb') as f:
+            f.writelines(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def sample(self, log_path, rate, block_size):
+        info = {}
+        blocks = list(la.get_sampled_blocks(log_path, rate, info, block_size))
+        return blocks, info
+
+    def test_get_sampled_blocks(self):
+        for log_path in (self.log_path, self.gz_path):
+            # every line once with blocks not aligned to lines
+            blocks, info = self.sample(log_path, 1, 25)
+            self.assertEqual(sum(blocks, []), self.lines)
+            self.assertEqual(info, {'number_blocks': 40,
+                                    'overall_blocks': 40})
+            # every 4th block of 10 lines: 0-9, 40-49 and 80-89
+            blocks, info = self.sample(log_path, 0.25, 100)
+            self.assertEqual(blocks, [self.lines[0:10], self.lines[40:50],
+                                      self.lines[80:90]])
+            self.assertEqual(info, {'number_blocks': 3,
+                                    'overall_blocks': 10})
+
+    def test_parse_log_sample(self):
+        data = la.parse_log_sample(
+            'tests/log/nginx-access-ui.log-20170625.txt', 1)
+        sample = data.pop('sample')
+        self.assertEqual(
+            data, la.parse_log('tests/log/nginx-access-ui.log-20170625.txt'))
+        self.assertEqual(sample['number_blocks'], 1)
+        self.assertEqual(sample['overall_blocks'], 1)
+        self.assertEqual(sample['blocks']['/api/v2/banner/25013431'],
+                         [1, 1, 0.917, 0.917 ** 2])
+
+    def test_get_cluster_ci(self):
+        # not enough blocks to estimate variance
+        self.assertEqual(la.get_cluster_ci(5, 25, 1, 10), None)
+        # the same value in every block
+        self.assertEqual(la.get_cluster_ci(6, 12, 3, 10), 0)
+        # the whole log is read
+        self.assertEqual(la.get_cluster_ci(6, 14, 3, 3), 0)
+        # values 1, 2, 3: variance 1
+        self.assertAlmostEqual(la.get_cluster_ci(6, 14, 3, 12),
+                               1.96 * 12 * (0.75 / 3) ** 0.5)
+
+    def test_get_stat_sample(self):
+        stat = la.get_stat({
+            'counter': {'/a': [1.0, 2.0, 3.0]},
+            'number_urls': 3,
+            'overall_request_time': 6.0,
+            'sample': {
+                'number_blocks': 3,
+                'overall_blocks': 12,
+                'blocks': {'/a': [3, 3, 6.0, 14.0]}
+            }
+        })
+        self.assertEqual(stat, [{
+            'url': '/a',
+            'count': 12,
+            'count_ci': 0.0,
+            'count_perc': 100.0,
+            'time_sum': 24.0,
+            'time_sum_ci': round(1.96 * 12 * 0.5, la.PREC),
+            'time_perc': 1.0,
+            'time_avg': 2.0,
+            'time_max': 3.0,
+            'time_med': 2.0
+        }])
+
+
 if __name__ == '__main__':
     unittest.main()
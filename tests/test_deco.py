@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import operator
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import json
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+import src.deco as deco
+
+
+class MemoTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def add(self, a, b):
+        self.calls.append((a, b))
+        return a + b
+
+    def test_memo(self):
+        add = deco.memo(self.add)
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(self.calls, [(1, 2)])
+        self.assertEqual(add.cache_info(), deco.CacheInfo(1, 1, None, 1))
+
+        add.cache_clear()
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(add.cache_info(), deco.CacheInfo(0, 1, None, 1))
+
+    def test_memo_unhashable(self):
+        add = deco.memo(self.add)
+        self.assertEqual(add([1], [2]), [1, 2])
+        self.assertEqual(add([1], [2]), [1, 2])
+        self.assertEqual(add([1], [3]), [1, 3])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_memo_maxsize(self):
+        add = deco.memo(maxsize=2)(self.add)
+        add(1, 1)
+        add(2, 2)
+        add(1, 1)  # (2, 2) is the least recently used now
+        add(3, 3)
+        self.assertEqual(add.cache_info().currsize, 2)
+        add(1, 1)
+        self.assertEqual(len(self.calls), 3)
+        add(2, 2)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_memo_ttl(self):
+        add = deco.memo(self.add, ttl=0.01)
+        add(1, 1)
+        add(1, 1)
+        self.assertEqual(len(self.calls), 1)
+        time.sleep(0.02)
+        add(1, 1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_memo_typed(self):
+        name = deco.memo(lambda x: type(x).__name__)
+        self.assertEqual([name(1), name(1.0), name(True), name(1)],
+                         ['int', 'float', 'bool', 'int'])
+        self.assertEqual(name.cache_info().currsize, 3)
+
+    def test_memo_ttl_sweep(self):
+        add = deco.memo(self.add, ttl=0.01)
+        for x in range(100):
+            add(x, x)
+        self.assertEqual(add.cache_info().currsize, 100)
+        time.sleep(0.02)
+        add(-1, -1)
+        self.assertEqual(add.cache_info().currsize, 1)
+
+    def test_memo_stacked(self):
+        self.assertEqual(deco.foo(4, 3), 7)
+        calls = deco.foo.calls
+        self.assertEqual(deco.foo(4, 3), 7)
+        self.assertEqual(deco.foo(5, 3, 2), 10)
+        self.assertEqual(deco.foo.calls, calls + 1)
+
+
+class ThreadSafeMemoTest(unittest.TestCase):
+    def run_threads(self, target, number=8):
+        threads = [threading.Thread(target=target) for _ in range(number)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_single_flight(self):
+        calls = []
+        results = []
+
+        @deco.memo(threadsafe=True)
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return x * 2
+
+        self.run_threads(lambda: results.append(slow(21)))
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * 8)
+        self.assertEqual(slow.cache_info().misses, 1)
+
+    def test_single_flight_error(self):
+        calls = []
+        errors = []
+
+        @deco.memo(threadsafe=True)
+        def fail(x):
+            calls.append(x)
+            time.sleep(0.05)
+            raise ValueError(x)
+
+        def target():
+            try:
+                fail(1)
+            except ValueError as e:
+                errors.append(e)
+
+        self.run_threads(target)
+        self.assertEqual(len(errors), 8)
+        self.assertEqual(len(calls), 1)
+        # errors are not cached
+        with self.assertRaises(ValueError):
+            fail(1)
+        self.assertEqual(len(calls), 2)
+
+    def test_different_keys(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        @deco.memo(threadsafe=True)
+        def func(x):
+            if x == 'slow':
+                started.set()
+                release.wait(1)
+            return x
+
+        thread = threading.Thread(target=func, args=('slow',))
+        thread.start()
+        started.wait(1)
+        # another key is computed while 'slow' is still in progress
+        self.assertEqual(func('fast'), 'fast')
+        self.assertFalse(release.is_set())
+        release.set()
+        thread.join()
+
+
+class InstrumentTest(unittest.TestCase):
+    def tearDown(self):
+        deco.set_instrumentation(True)
+
+    def test_instrument(self):
+        @deco.instrument(name='test.sleep')
+        def sleep(seconds):
+            time.sleep(seconds)
+
+        sleep(0.01)
+        sleep(0)
+        self.assertEqual(sleep.calls, 2)
+        self.assertIs(deco.REGISTRY[sleep.stat.name], sleep.stat)
+        stat = sleep.stat.as_dict()
+        self.assertEqual(stat['calls'], 2)
+        self.assertGreaterEqual(stat['max'], 0.01)
+        self.assertGreaterEqual(stat['total'], stat['max'])
+        self.assertEqual(sum(stat['histogram']), 2)
+        self.assertIn(sleep.stat.name, deco.stats_report())
+        snapshot = json.loads(deco.stats_json())
+        self.assertIn(sleep.stat.name,
+                      [d['name'] for d in snapshot['stats']])
+
+        deco.set_instrumentation(False)
+        sleep(0)
+        self.assertEqual(sleep.calls, 2)
+
+        deco.reset_stats()
+        self.assertEqual(sleep.stat.calls, 0)
+        self.assertNotIn(sleep.stat.name, deco.stats_report())
+
+    def test_instrument_same_name(self):
+        def make():
+            @deco.countcalls
+            def func():
+                pass
+            return func
+
+        first = make()
+        first()
+        second = make()
+        self.assertEqual(first.calls, 1)
+        self.assertEqual(second.calls, 0)
+        self.assertIsNot(first.stat, second.stat)
+        self.assertIs(deco.REGISTRY[second.stat.name], second.stat)
+        self.assertEqual(second.stat.name, first.stat.name + '#2')
+
+    def test_instrument_error(self):
+        @deco.instrument(name='test.fail')
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            fail()
+        self.assertEqual(fail.calls, 1)
+
+
+def concat_lists(a, b):
+    return a + b
+
+
+class NAryTest(unittest.TestCase):
+    def test_n_ary(self):
+        pair = deco.n_ary(lambda a, b: (a, b))
+        self.assertEqual(pair(1), 1)
+        self.assertEqual(pair(1, 2), (1, 2))
+        self.assertEqual(pair(1, 2, 3, 4), (1, (2, (3, 4))))
+        with self.assertRaises(TypeError):
+            pair()
+
+    def test_n_ary_many_args(self):
+        add = deco.n_ary(operator.add)
+        self.assertEqual(add(*range(100000)), sum(range(100000)))
+
+    def test_n_ary_pool(self):
+        pool = ThreadPool(4)
+        concat = deco.n_ary(operator.add, associative=True, pool=pool,
+                            chunksize=10)
+        args = [[x] for x in range(1000)]
+        self.assertEqual(concat(*args), list(range(1000)))
+        pool.close()
+
+    def test_n_ary_process_pool(self):
+        pool = multiprocessing.Pool(2)
+        concat = deco.n_ary(concat_lists, associative=True, pool=pool,
+                            chunksize=10)
+        args = [[x] for x in range(1000)]
+        self.assertEqual(concat(*args), list(range(1000)))
+        pool.close()
+        pool.join()
+
+    def test_n_ary_chunksize(self):
+        for chunksize in (0, 1):
+            with self.assertRaises(ValueError):
+                deco.n_ary(operator.add, associative=True, chunksize=chunksize)
+
+
+class TraceTest(unittest.TestCase):
+    def test_ring_trace(self):
+        @deco.trace('__', size=100)
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+
+        self.assertEqual(fib(3), 3)
+        lines = fib.dump_trace().splitlines()
+        self.assertEqual(lines[0], 'Thread MainThread:')
+        self.assertEqual(
+            [line.split(' in ')[0] for line in lines[1:]],
+            [' fib(3) == 3', '__ fib(2) == 2', '____ fib(1) == 1',
+             '____ fib(0) == 1', '__ fib(1) == 1']
+        )
+        fib.clear_trace()
+        self.assertEqual(fib.dump_trace(), 'Thread MainThread:')
+
+    def test_ring_trace_size_and_sample(self):
+        @deco.trace('', size=3, sample=2)
+        def identity(x):
+            return x
+
+        for x in range(10):
+            identity(x)
+        lines = identity.dump_trace().splitlines()[1:]
+        self.assertEqual([line.split(' in ')[0] for line in lines],
+                         [' identity(4) == 4', ' identity(6) == 6',
+                          ' identity(8) == 8'])
+
+    def test_ring_trace_error(self):
+        @deco.trace('', size=3)
+        def fail():
+            raise ValueError('oops')
+
+        with self.assertRaises(ValueError):
+            fail()
+        self.assertIn("raised ValueError('oops',)", fail.dump_trace())
+
+    def test_ring_trace_threads(self):
+        @deco.trace('', size=3)
+        def identity(x):
+            return x
+
+        for x in range(3):
+            thread = threading.Thread(target=identity, args=(x,),
+                                      name='worker{}'.format(x))
+            thread.start()
+            thread.join()
+        # buffers of finished threads are dropped when a new one starts
+        self.assertEqual(identity.dump_trace().splitlines()[0],
+                         'Thread worker2:')
+        # and after they are dumped
+        self.assertEqual(identity.dump_trace(), '')
+
+    def test_ring_trace_arguments(self):
+        with self.assertRaises(ValueError):
+            deco.trace('', size=0)
+        with self.assertRaises(ValueError):
+            deco.trace('', size=10, sample=0)
+
+
+class Future(object):
+    """The least future: results are set by the test"""
+
+    def __init__(self):
+        self.callbacks = []
+        self.done = False
+        self.value = self.error = None
+
+    def add_done_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def finish(self, value=None, error=None):
+        self.value, self.error, self.done = value, error, True
+        for callback in self.callbacks:
+            callback(self)
+
+    def exception(self):
+        return self.error
+
+
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.futures = []
+
+    def fetch(self, x):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def test_async_memo(self):
+        fetch = deco.async_memo(self.fetch)
+        first = fetch(1)
+        # in progress: the same future
+        self.assertIs(fetch(1), first)
+        first.finish(2)
+        self.assertIs(fetch(1), first)
+        self.assertIsNot(fetch(2), first)
+        self.assertEqual(len(self.futures), 2)
+        self.assertEqual(fetch.cache_info(), deco.CacheInfo(2, 2, None, 2))
+
+    def test_async_memo_error(self):
+        fetch = deco.async_memo(maxsize=10)(self.fetch)
+        fetch(1).finish(error=ValueError())
+        second = fetch(1)
+        self.assertIsNot(second, self.futures[0])
+        second.finish(2)
+        self.assertIs(fetch(1), second)
+
+    def test_async_memo_threads(self):
+        # failed futures are dropped by callbacks in other threads, as
+        # concurrent.futures does, while the cache is used
+        fetch = deco.async_memo(maxsize=8)(self.fetch)
+        finishers = []
+
+        def fail_all():
+            for x in range(200):
+                finisher = threading.Thread(
+                    target=fetch(x % 16).finish,
+                    kwargs={'error': ValueError()}
+                )
+                finisher.start()
+                finishers.append(finisher)
+
+        threads = [threading.Thread(target=fail_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # all the finishers are started only when fail_all threads are done
+        for thread in finishers:
+            thread.join()
+        self.assertEqual(fetch.cache_info().currsize, 0)
+
+    def test_async_memo_not_future(self):
+        with self.assertRaises(TypeError):
+            deco.async_memo(lambda x: x)(1)
+
+    def test_async_instrument(self):
+        fetch = deco.async_instrument(self.fetch, name='test.fetch')
+        future = fetch(1)
+        self.assertEqual(fetch.calls, 0)
+        time.sleep(0.01)
+        future.finish(1)
+        self.assertEqual(fetch.calls, 1)
+        self.assertGreaterEqual(fetch.stat.max, 0.01)
+
+
+def square(x):
+    return x * x
+
+
+def make_other_square():
+    def square(x):
+        return -x * x
+    return square
+
+
+other_square = make_other_square()
+DOUBLED = []
+
+
+def double(x):
+    DOUBLED.append(x)
+    return {'x': x * 2}
+
+
+def fill_cache(db_path):
+    deco.memo(square, persist=db_path)(3)
+
+
+class PersistMemoTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'memo.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_persist(self):
+        del DOUBLED[:]
+        deco.memo(double, persist=self.db_path)(1)
+        # another instance with the same function reads the same cache
+        cached = deco.memo(double, persist=self.db_path)
+        self.assertEqual(cached(1), {'x': 2})
+        self.assertEqual(cached([1]), {'x': [1, 1]})
+        self.assertEqual(cached([1]), {'x': [1, 1]})
+        self.assertEqual(DOUBLED, [1, [1]])
+        self.assertEqual(cached.cache_info().currsize, 2)
+
+        cached.cache_clear()
+        self.assertEqual(cached.cache_info().currsize, 0)
+
+    def test_persist_same_name(self):
+        first = deco.memo(square, persist=self.db_path)
+        second = deco.memo(other_square, persist=self.db_path)
+        self.assertEqual(first(3), 9)
+        self.assertEqual(second(3), -9)
+
+    def test_persist_lambda_and_closure(self):
+        with self.assertRaises(ValueError):
+            deco.memo(lambda x: x, persist=self.db_path)
+        y = 1
+
+        def add(x):
+            return x + y
+
+        with self.assertRaises(ValueError):
+            deco.memo(add, persist=self.db_path)
+
+    def test_persist_maxsize(self):
+        cached = deco.memo(square, maxsize=2, persist=self.db_path)
+        for x in range(5):
+            cached(x)
+        self.assertEqual(cached.cache_info().currsize, 2)
+
+    def test_persist_ttl(self):
+        cached = deco.memo(square, ttl=0.01, persist=self.db_path)
+        self.assertEqual(cached.cache_info().maxsize, deco.DISK_MAXSIZE)
+        for x in range(deco.DISK_BATCH - 1):
+            cached(x)
+        time.sleep(0.02)
+        self.assertEqual(cached.cache_info().currsize, 0)
+        # expired entries are deleted from the database on eviction
+        cached(-1)
+        rows = sqlite3.connect(self.db_path).execute(
+            'SELECT COUNT(*) FROM memo').fetchone()[0]
+        self.assertEqual(rows, 1)
+
+    def test_persist_threadsafe(self):
+        cached = deco.memo(square, maxsize=10, threadsafe=True,
+                           persist=self.db_path)
+        self.assertEqual([cached(2), cached(2), cached(3)], [4, 4, 9])
+        self.assertEqual(cached.cache_info(), deco.CacheInfo(1, 2, 10, 2))
+
+    def test_persist_processes(self):
+        process = multiprocessing.Process(target=fill_cache,
+                                          args=(self.db_path,))
+        process.start()
+        process.join()
+        cached = deco.memo(square, persist=self.db_path)
+        self.assertEqual(cached(3), 9)
+        self.assertEqual(cached.cache_info().hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()